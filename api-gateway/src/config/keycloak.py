@@ -1,7 +1,24 @@
+import asyncio
+import time
+from jose import jwt
 from keycloak import KeycloakOpenID
 from src.config.settings import get_settings
+from src.utils.token_cache import TokenCache
 from functools import lru_cache
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Optional, Tuple
+
+# Minimum age (seconds) of the cached JWKS before a forced refresh is honoured,
+# so tokens with unknown key IDs can't hammer Keycloak
+JWKS_MIN_REFRESH_INTERVAL = 30
+
+# Cached realm JWKS as (fetched_at, jwks), shared by all requests in the process
+_jwks_cache: Optional[Tuple[float, Dict[str, Any]]] = None
+# In-flight fetch shared by every request that misses the cache (single-flight)
+_jwks_task: Optional[asyncio.Task] = None
+_jwks_lock = asyncio.Lock()
+
+# Verified token payloads, reused until each token's exp
+_token_cache = TokenCache(maxsize=50_000)
 
 
 @lru_cache()
@@ -29,10 +46,52 @@ async def get_public_key() -> str:
     return keycloak_client.public_key()
 
 
+async def _fetch_jwks() -> Dict[str, Any]:
+    """Fetch the realm's JWKS from Keycloak and store it in the cache."""
+    global _jwks_cache
+    keycloak_client = get_keycloak_openid()
+    jwks = await asyncio.to_thread(keycloak_client.certs)
+    _jwks_cache = (time.monotonic(), jwks)
+    return jwks
+
+
+async def get_jwks(force_refresh: bool = False) -> Dict[str, Any]:
+    """
+    Returns the realm's JSON Web Key Set used to verify token signatures.
+    
+    The key set is fetched from Keycloak once and reused until it is older
+    than the configured TTL, so token verification stays in-process. When
+    the cache misses, concurrent callers all await a single fetch.
+    
+    Args:
+        force_refresh: Fetch a fresh key set even if the cached one is valid
+    """
+    global _jwks_task
+    max_age = JWKS_MIN_REFRESH_INTERVAL if force_refresh else get_settings().jwks_cache_ttl_seconds
+    
+    if _jwks_cache and time.monotonic() - _jwks_cache[0] < max_age:
+        return _jwks_cache[1]
+    
+    async with _jwks_lock:
+        # A fetch may have completed while we waited for the lock
+        if _jwks_cache and time.monotonic() - _jwks_cache[0] < max_age:
+            return _jwks_cache[1]
+        if _jwks_task is None or _jwks_task.done():
+            _jwks_task = asyncio.create_task(_fetch_jwks())
+        task = _jwks_task
+    
+    # Shielded so a cancelled request doesn't abort the fetch for the others
+    return await asyncio.shield(task)
+
+
 async def verify_token(token: str) -> Dict[str, Any]:
     """
     Verifies the JWT token and returns the decoded token information.
     
+    The RS256 signature, audience and expiry are checked locally against the
+    cached JWKS; no request is made to Keycloak unless the keys need refreshing.
+    Verified payloads are cached until the token expires.
+    
     Args:
         token: The JWT token to verify
         
@@ -42,22 +101,40 @@ async def verify_token(token: str) -> Dict[str, Any]:
     Raises:
         Exception: If token validation fails
     """
-    keycloak_client = get_keycloak_openid()
-    return keycloak_client.decode_token(
+    cached = _token_cache.get(token)
+    if cached is not None:
+        return cached
+    
+    settings = get_settings()
+    jwks = await get_jwks()
+    
+    # Refresh once if the token was signed with a key we haven't seen (key rotation)
+    kid = jwt.get_unverified_header(token).get("kid")
+    if kid and not any(key.get("kid") == kid for key in jwks.get("keys", [])):
+        jwks = await get_jwks(force_refresh=True)
+    
+    token_info = jwt.decode(
         token,
-        key=await get_public_key(),
+        jwks,
+        algorithms=["RS256"],
+        audience=settings.keycloak_client_id,
         options={
             "verify_signature": True,
             "verify_aud": True,
             "verify_exp": True
         }
     )
+    _token_cache.set(token, token_info)
+    return token_info
 
 
 async def get_user_info(token: str) -> Dict[str, Any]:
     """
     Gets user information using the provided token.
     
+    This is a network round trip to Keycloak; use verify_token on the
+    request path and reserve this for explicit lookups.
+    
     Args:
         token: The access token
         
@@ -72,6 +149,9 @@ async def introspect_token(token: str) -> Dict[str, Any]:
     """
     Performs token introspection to validate and get token metadata.
     
+    This is a network round trip to Keycloak; use it for explicit
+    revocation checks rather than on every request.
+    
     Args:
         token: The token to introspect
         
@@ -0,0 +1,23 @@
+import redis.asyncio as aioredis
+from functools import lru_cache
+from src.config.settings import get_settings
+
+
+@lru_cache()
+def get_redis_client() -> aioredis.Redis:
+    """
+    Return the process-wide async Redis client.
+
+    All callers (rate limiter, health checks) share one connection pool sized
+    by ``redis_max_connections``. Connections are opened lazily, so this is
+    safe to call at import time; the application lifespan checks the
+    connection on startup and closes the pool on shutdown.
+    """
+    settings = get_settings()
+    pool = aioredis.ConnectionPool.from_url(
+        settings.redis_url,
+        max_connections=settings.redis_max_connections,
+        socket_connect_timeout=1,  # Short timeouts to avoid long waits
+        socket_timeout=1,
+    )
+    return aioredis.Redis(connection_pool=pool)
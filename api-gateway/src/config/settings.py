@@ -20,16 +20,21 @@ class Settings(BaseSettings):
     
     # Redis
     redis_url: str = "redis://redis:6379/0"
+    redis_max_connections: int = 64
     
     # Rate limiting
     rate_limit_per_minute: int = 100
     rate_limit_window_seconds: int = 60
+    rate_limit_exclude_paths: List[str] = ["/health", "/metrics"]
     
     # Keycloak
     oidc_url: str = "http://keycloak:8080/auth"
     keycloak_realm: str = "retail"
     keycloak_client_id: str = "retail-gateway"
     keycloak_client_secret: str = "your-secret"
+    jwks_cache_ttl_seconds: int = 3600
+    # Verify HS256 tokens with the built-in verifier; False falls back to PyJWT
+    jwt_fast_verify: bool = True
     
     # API endpoints
     product_service_url: str = "http://product-service:8001/api"
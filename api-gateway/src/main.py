@@ -1,15 +1,21 @@
+import asyncio
 import logging
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, Depends
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 from fastapi.openapi.docs import get_swagger_ui_html
 from fastapi.openapi.utils import get_openapi
 from starlette.middleware import Middleware
-from starlette.responses import JSONResponse
+from fastapi.responses import ORJSONResponse
+from src.config.redis import get_redis_client
 from src.config.settings import get_settings
 from src.middleware.auth import AuthMiddleware
-from src.middleware.rate_limiter import RateLimiterMiddleware
-from src.middleware.logging import LoggingMiddleware
+from src.middleware.rate_limiter import RateLimiterMiddleware, load_rate_limit_scripts
+from src.middleware.logging import LoggingMiddleware, create_metrics_queue, drain_metrics, flush_metrics
 from src.routes import health, products
+from src.utils.http_client import close_shared_clients
+import httpx
 import uvicorn
 
 # Configure logging
@@ -32,10 +38,59 @@ middleware = [
         allow_credentials=True,
     ),
     Middleware(LoggingMiddleware),
-    Middleware(RateLimiterMiddleware, redis_url=settings.redis_url),
+    # Per-IP limit in front of auth, so floods of missing or invalid tokens
+    # are throttled before each one is verified
+    Middleware(RateLimiterMiddleware, redis_client=get_redis_client(), pre_auth=True),
     Middleware(AuthMiddleware, exclude_paths=["/health", "/docs", "/redoc", "/openapi.json"]),
+    # Per-client limits, using the identity the auth middleware verified
+    Middleware(RateLimiterMiddleware, redis_client=get_redis_client()),
+    # Compress larger responses (e.g. product lists) for clients. Kept inside
+    # the BaseHTTPMiddleware layers, which re-stream every body and would
+    # defeat minimum_size.
+    Middleware(GZipMiddleware, minimum_size=1024),
 ]
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Open shared resources on startup and release them on shutdown"""
+    logger.info(f"Starting {settings.app_name} v{settings.app_version} in {settings.environment} mode")
+    
+    # One Redis connection pool for the whole process
+    app.state.redis = get_redis_client()
+    try:
+        await app.state.redis.ping()
+        await load_rate_limit_scripts(app.state.redis)
+    except Exception as e:
+        logger.warning(f"Redis unavailable at startup, rate limiting will fail open: {e}")
+    
+    # One pooled HTTP/2 client for calls to the product service
+    app.state.http = httpx.AsyncClient(
+        base_url=settings.product_service_url,
+        http2=True,
+        timeout=httpx.Timeout(10.0, connect=2.0),
+        limits=httpx.Limits(max_connections=200, max_keepalive_connections=100),
+        # httpx's default Accept-Encoding already asks for every encoding it
+        # can decode (gzip, deflate, and br with the brotli extra)
+    )
+    
+    # Batched writer for per-request metrics
+    app.state.metrics_queue = create_metrics_queue()
+    metrics_task = asyncio.create_task(flush_metrics(app.state.metrics_queue))
+    
+    yield
+    
+    logger.info(f"Shutting down {settings.app_name}")
+    metrics_task.cancel()
+    try:
+        await metrics_task
+    except asyncio.CancelledError:
+        pass
+    drain_metrics(app.state.metrics_queue)
+    await close_shared_clients()
+    await app.state.http.aclose()
+    await app.state.redis.close()
+    await app.state.redis.connection_pool.disconnect()
+
 # Initialize FastAPI
 app = FastAPI(
     title=settings.app_name,
@@ -46,6 +101,8 @@ app = FastAPI(
     openapi_url="/openapi.json" if settings.environment != "production" else None,
     middleware=middleware,
     debug=settings.debug,
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse,
 )
 
 # Include routers
@@ -111,7 +168,7 @@ async def root():
 # Simple error handlers
 @app.exception_handler(404)
 async def not_found_exception_handler(request, exc):
-    return JSONResponse(
+    return ORJSONResponse(
         status_code=404,
         content={"detail": "Resource not found"}
     )
@@ -119,20 +176,11 @@ async def not_found_exception_handler(request, exc):
 @app.exception_handler(500)
 async def server_error_exception_handler(request, exc):
     logger.error(f"Internal server error: {str(exc)}")
-    return JSONResponse(
+    return ORJSONResponse(
         status_code=500,
         content={"detail": "Internal server error"}
     )
 
-# Startup and shutdown events
-@app.on_event("startup")
-async def startup_event():
-    logger.info(f"Starting {settings.app_name} v{settings.app_version} in {settings.environment} mode")
-
-@app.on_event("shutdown")
-async def shutdown_event():
-    logger.info(f"Shutting down {settings.app_name}")
-
 # For direct running
 if __name__ == "__main__":
     # Run server
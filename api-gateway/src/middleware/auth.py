@@ -1,10 +1,11 @@
-from fastapi import Request, HTTPException, status
-from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from starlette.middleware.base import BaseHTTPMiddleware
-from src.config.keycloak import verify_token, get_user_info
+from fastapi import status
+from starlette.types import ASGIApp, Receive, Scope, Send
+from src.config.keycloak import verify_token
 from src.config.settings import get_settings
+from functools import lru_cache
+import json
 import logging
-from typing import Optional, List
+from typing import Optional, List, Tuple
 
 logger = logging.getLogger(__name__)
 
@@ -16,72 +17,109 @@ PUBLIC_ROUTES = [
     "/openapi.json",
 ]
 
-class AuthMiddleware(BaseHTTPMiddleware):
+@lru_cache(maxsize=None)
+def _prebuilt_error(
+    status_code: int, detail: str, www_authenticate: bool = False
+) -> Tuple[int, Tuple[Tuple[bytes, bytes], ...], bytes]:
+    """
+    Serialize a JSON error response once per distinct (status, detail) and
+    return it as (status, raw headers, body) ready to be sent over ASGI.
+    """
+    body = json.dumps({"detail": detail}, separators=(",", ":")).encode()
+    headers = [
+        (b"content-type", b"application/json"),
+        (b"content-length", str(len(body)).encode()),
+    ]
+    if www_authenticate:
+        headers.append((b"www-authenticate", b"Bearer"))
+    return status_code, tuple(headers), body
+
+
+async def _send_prebuilt(send: Send, response: Tuple[int, Tuple[Tuple[bytes, bytes], ...], bytes]):
+    """Send a prebuilt response. The header list is copied since outer middleware may append to it."""
+    status_code, headers, body = response
+    await send({"type": "http.response.start", "status": status_code, "headers": list(headers)})
+    await send({"type": "http.response.body", "body": body})
+
+
+class AuthMiddleware:
+    """
+    Pure ASGI middleware that validates the bearer token on every request.
+    
+    The Authorization header is read straight from the ASGI scope, and the
+    verified token is stored in the request state for downstream handlers.
+    """
     def __init__(
         self, 
-        app, 
+        app: ASGIApp, 
         oidc_url: str = None,
         exclude_paths: Optional[List[str]] = None
     ):
-        super().__init__(app)
+        self.app = app
         self.exclude_paths = exclude_paths or PUBLIC_ROUTES
         self.settings = get_settings()
         
-    async def dispatch(self, request: Request, call_next):
+        # Precomputed for the per-request checks on the raw ASGI values
+        self._exclude_prefixes = tuple(p.encode() for p in self.exclude_paths)
+        
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+            
         # Skip authentication for excluded paths
-        path = request.url.path
-        if any(path.startswith(route) for route in self.exclude_paths):
-            return await call_next(request)
+        raw_path = scope.get("raw_path") or scope["path"].encode()
+        if raw_path.startswith(self._exclude_prefixes):
+            await self.app(scope, receive, send)
+            return
             
         # Get token from header
-        auth_header = request.headers.get("Authorization")
+        auth_header = next((v for k, v in scope["headers"] if k == b"authorization"), None)
         if not auth_header:
-            return self._unauthorized_response("Missing Authorization header")
+            await self._unauthorized_response(send, "Missing Authorization header")
+            return
             
-        try:
-            scheme, token = auth_header.split()
-            if scheme.lower() != "bearer":
-                return self._unauthorized_response("Invalid authentication scheme")
-        except ValueError:
-            return self._unauthorized_response("Invalid Authorization header format")
+        if auth_header[:7].lower() != b"bearer ":
+            detail = "Invalid authentication scheme" if b" " in auth_header else "Invalid Authorization header format"
+            await self._unauthorized_response(send, detail)
+            return
+            
+        token_bytes = auth_header[7:].strip()
+        if not token_bytes or b" " in token_bytes:
+            await self._unauthorized_response(send, "Invalid Authorization header format")
+            return
+        token = token_bytes.decode("latin-1")
             
         try:
-            # Verify token
+            # Verify token locally against the cached realm keys
             token_info = await verify_token(token)
-            
-            # Add user info to request state
-            request.state.user = token_info
-            request.state.token = token
-            
-            # Check for required scopes/roles if needed
-            # This could be enhanced with path-specific role requirements
-            if not self._has_required_permissions(request, token_info):
-                return self._forbidden_response("Insufficient permissions")
-                
-            return await call_next(request)
-            
         except Exception as e:
             logger.error(f"Authentication error: {str(e)}")
-            return self._unauthorized_response("Invalid or expired token")
+            await self._unauthorized_response(send, "Invalid or expired token")
+            return
+            
+        # Add user info to request state
+        state = scope.setdefault("state", {})
+        state["user"] = token_info
+        state["token"] = token
+        
+        # Check for required scopes/roles if needed
+        # This could be enhanced with path-specific role requirements
+        if not self._has_required_permissions(scope, token_info):
+            await self._forbidden_response(send, "Insufficient permissions")
+            return
+            
+        await self.app(scope, receive, send)
             
-    def _unauthorized_response(self, detail: str):
-        """Return a 401 Unauthorized response"""
-        from fastapi.responses import JSONResponse
-        return JSONResponse(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            content={"detail": detail},
-            headers={"WWW-Authenticate": "Bearer"}
-        )
+    async def _unauthorized_response(self, send: Send, detail: str):
+        """Send a 401 Unauthorized response"""
+        await _send_prebuilt(send, _prebuilt_error(status.HTTP_401_UNAUTHORIZED, detail, True))
         
-    def _forbidden_response(self, detail: str):
-        """Return a 403 Forbidden response"""
-        from fastapi.responses import JSONResponse
-        return JSONResponse(
-            status_code=status.HTTP_403_FORBIDDEN,
-            content={"detail": detail}
-        )
+    async def _forbidden_response(self, send: Send, detail: str):
+        """Send a 403 Forbidden response"""
+        await _send_prebuilt(send, _prebuilt_error(status.HTTP_403_FORBIDDEN, detail))
         
-    def _has_required_permissions(self, request: Request, token_info: dict) -> bool:
+    def _has_required_permissions(self, scope: Scope, token_info: dict) -> bool:
         """
         Check if the user has the required permissions for this request.
         This can be enhanced to check specific roles per endpoint.
@@ -1,17 +1,106 @@
+import asyncio
 import time
 import logging
-import uuid
-import json
+import secrets
+import sys
+import orjson
 from fastapi import Request, Response
 from starlette.middleware.base import BaseHTTPMiddleware
 from starlette.types import ASGIApp
 from src.config.settings import get_settings
 import traceback
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List, Tuple
 
 # Configure logger
 logger = logging.getLogger(__name__)
 
+# Per-request metrics are queued and written out in batches by flush_metrics(),
+# so the log sink sees one record per batch rather than one per request
+METRICS_QUEUE_SIZE = 10_000
+METRICS_BATCH_SIZE = 500
+METRICS_FLUSH_INTERVAL = 0.2  # seconds
+
+# Each metrics record is a JSON array with this fixed field order
+METRICS_FIELDS = (
+    "request_id", "path", "method", "status_code", "process_time_ms", "user_id", "timestamp"
+)
+MetricsRecord = Tuple[str, str, str, int, int, str, float]
+
+_METRICS_PREFIX = b"METRICS_BATCH: "
+_METRICS_OPT = orjson.OPT_APPEND_NEWLINE
+
+class MetricsHandler(logging.StreamHandler):
+    """
+    Writes pre-serialized metrics batches (bytes) straight to the stream,
+    skipping the Formatter and the str encode/decode round trip.
+    """
+    
+    def __init__(self, stream=None):
+        stream = stream or sys.stdout
+        # Write to the underlying binary buffer when there is one (text
+        # streams such as pytest's capture don't have it)
+        self._text_stream = stream
+        self._binary = hasattr(stream, "buffer")
+        super().__init__(stream.buffer if self._binary else stream)
+    
+    def emit(self, record: logging.LogRecord):
+        try:
+            if self._binary:
+                # Push out text other handlers have buffered on the same
+                # stream first, so lines aren't reordered or interleaved
+                self._text_stream.flush()
+                self.stream.write(record.msg)
+            else:
+                self.stream.write(record.msg.decode())
+            self.flush()
+        except Exception:
+            self.handleError(record)
+
+metrics_logger = logging.getLogger(f"{__name__}.metrics")
+metrics_logger.addHandler(MetricsHandler())
+metrics_logger.propagate = False
+
+MetricsQueue = "asyncio.Queue[MetricsRecord]"
+
+def create_metrics_queue() -> MetricsQueue:
+    """
+    Create the queue LoggingMiddleware feeds. Made per app lifespan (and
+    stored on app.state.metrics_queue), since a queue binds to the event loop
+    that first waits on it.
+    """
+    return asyncio.Queue(maxsize=METRICS_QUEUE_SIZE)
+
+def _log_metrics_batch(batch: List[MetricsRecord]):
+    metrics_logger.info(_METRICS_PREFIX + orjson.dumps(batch, option=_METRICS_OPT))
+
+def drain_metrics(queue: MetricsQueue, batch: Optional[List[MetricsRecord]] = None):
+    """Write out everything still queued (e.g. on shutdown)"""
+    batch = batch or []
+    while not queue.empty():
+        batch.append(queue.get_nowait())
+        if len(batch) >= METRICS_BATCH_SIZE:
+            _log_metrics_batch(batch)
+            batch = []
+    if batch:
+        _log_metrics_batch(batch)
+
+async def flush_metrics(queue: MetricsQueue):
+    """
+    Background task that batches queued metrics.
+    
+    Waits for the first record, gives the queue METRICS_FLUSH_INTERVAL to
+    fill up, then logs everything queued in batches of at most
+    METRICS_BATCH_SIZE records.
+    """
+    while True:
+        batch = [await queue.get()]
+        try:
+            await asyncio.sleep(METRICS_FLUSH_INTERVAL)
+        finally:
+            # Also on cancellation (shutdown), so the record already taken
+            # off the queue isn't lost
+            drain_metrics(queue, batch)
+
 class LoggingMiddleware(BaseHTTPMiddleware):
     def __init__(
         self, 
@@ -25,88 +114,117 @@ class LoggingMiddleware(BaseHTTPMiddleware):
         
         # Paths to exclude from detailed logging (e.g., health checks)
         self.exclude_paths = exclude_paths or ["/health", "/metrics"]
+        # str.startswith accepts a tuple and checks every prefix in C
+        self._exclude_prefixes = tuple(self.exclude_paths)
         
     async def dispatch(self, request: Request, call_next):
-        # Generate a unique request ID
-        request_id = str(uuid.uuid4())
+        # Reuse the request ID assigned by an upstream proxy/load balancer, or
+        # generate a unique one
+        request_id = request.headers.get("x-request-id")
+        if not request_id or len(request_id) > 128:
+            request_id = secrets.token_hex(16)
         request.state.request_id = request_id
         
         # Start timing
-        start_time = time.time()
+        start_time = time.perf_counter()
         
         # Extract basic request information
         path = request.url.path
         method = request.method
-        client_ip = request.client.host if request.client else "unknown"
-        user_agent = request.headers.get("User-Agent", "unknown")
         
         # Skip detailed logging for excluded paths
-        minimal_logging = any(path.startswith(excluded) for excluded in self.exclude_paths)
+        minimal_logging = path.startswith(self._exclude_prefixes)
         
         # Log the incoming request
         if not minimal_logging:
-            logger.info(f"Request started: {method} {path} - ID: {request_id}")
+            logger.info("Request started: %s %s - ID: %s", method, path, request_id)
             
             # More detailed info at debug level
-            logger.debug(
-                f"Request details: {method} {path} - Client: {client_ip} - "
-                f"User-Agent: {user_agent} - ID: {request_id}"
-            )
+            if logger.isEnabledFor(logging.DEBUG):
+                client_ip = request.client.host if request.client else "unknown"
+                user_agent = request.headers.get("User-Agent", "unknown")
+                logger.debug(
+                    "Request details: %s %s - Client: %s - User-Agent: %s - ID: %s",
+                    method, path, client_ip, user_agent, request_id
+                )
         
         # Process request and catch exceptions
         try:
             response = await call_next(request)
             
             # Calculate processing time
-            process_time = time.time() - start_time
+            process_time = time.perf_counter() - start_time
             
-            # Add response headers for tracking
-            response.headers["X-Request-ID"] = request_id
-            response.headers["X-Process-Time"] = str(process_time)
+            # Add response headers for tracking (not needed on health/metrics
+            # probes, which are the highest-volume paths)
+            if not minimal_logging:
+                response.headers["X-Request-ID"] = request_id
+                response.headers["X-Process-Time"] = f"{process_time:.3f}"
             
             # Log the response
             status_code = response.status_code
             if not minimal_logging or status_code >= 400:  # Always log errors
                 log_method = logger.info if status_code < 400 else logger.warning
                 log_method(
-                    f"Request completed: {method} {path} - Status: {status_code} - "
-                    f"Time: {process_time:.3f}s - ID: {request_id}"
+                    "Request completed: %s %s - Status: %s - Time: %.3fs - ID: %s",
+                    method, path, status_code, process_time, request_id
                 )
                 
                 # Log additional metrics for performance monitoring
-                self._log_metrics(request, status_code, process_time)
+                self._log_metrics(request, request_id, path, method, status_code, process_time)
             
             return response
             
         except Exception as e:
             # Calculate processing time
-            process_time = time.time() - start_time
+            process_time = time.perf_counter() - start_time
             
             # Log the exception
             logger.error(
-                f"Request failed: {method} {path} - Error: {str(e)} - "
-                f"Time: {process_time:.3f}s - ID: {request_id}"
+                "Request failed: %s %s - Error: %s - Time: %.3fs - ID: %s",
+                method, path, e, process_time, request_id
             )
             
             # Log stack trace at debug level
-            logger.debug(f"Exception traceback: {traceback.format_exc()}")
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Exception traceback: %s", traceback.format_exc())
             
             # Re-raise the exception to be handled by FastAPI
             raise
             
-    def _log_metrics(self, request: Request, status_code: int, process_time: float):
+    def _log_metrics(
+        self,
+        request: Request,
+        request_id: str,
+        path: str,
+        method: str,
+        status_code: int,
+        process_time: float,
+    ):
         """Log metrics in a format suitable for collection by monitoring systems"""
+        if not metrics_logger.isEnabledFor(logging.INFO):
+            return
+        
         user_id = getattr(request.state, "user", {}).get("sub", "anonymous")
         
-        metrics = {
-            "request_id": request.state.request_id,
-            "path": request.url.path,
-            "method": request.method,
-            "status_code": status_code,
-            "process_time_ms": int(process_time * 1000),
-            "user_id": user_id,
-            "timestamp": time.time(),
-        }
+        # Fields in METRICS_FIELDS order
+        metrics = (
+            request_id,
+            path,
+            method,
+            status_code,
+            int(process_time * 1000),
+            user_id,
+            time.time(),
+        )
         
-        # Log in JSON format for easy parsing by log collectors
-        logger.info(f"METRICS: {json.dumps(metrics)}")
+        # Queue for the batched JSON log line; drop rather than block when the
+        # flusher can't keep up. Without a lifespan (no queue), log it directly.
+        queue = getattr(request.app.state, "metrics_queue", None)
+        if queue is None:
+            _log_metrics_batch([metrics])
+            return
+        try:
+            queue.put_nowait(metrics)
+        except asyncio.QueueFull:
+            pass
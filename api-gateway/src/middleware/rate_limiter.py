@@ -1,27 +1,78 @@
 import redis
+import redis.asyncio as aioredis
+import secrets
 import time
 import logging
 from fastapi import Request
 from starlette.middleware.base import BaseHTTPMiddleware
-from starlette.responses import JSONResponse
+from fastapi.responses import ORJSONResponse
+from src.config.redis import get_redis_client
 from src.config.settings import get_settings
-from typing import Dict, Optional, Callable
+from typing import Dict, Optional, Callable, Tuple
 
 logger = logging.getLogger(__name__)
 
+# Sliding-window log: drop entries older than the window, decide on ZCARD
+# alone and only record the request when it is allowed. Rejections also
+# return the time until the oldest entry leaves the window.
+# Returns {allowed, count, reset_ms}.
+SLIDING_WINDOW_SCRIPT = """
+local now = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+local limit = tonumber(ARGV[3])
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now - window)
+local count = redis.call('ZCARD', KEYS[1])
+if count < limit then
+    redis.call('ZADD', KEYS[1], now, ARGV[4])
+    redis.call('PEXPIRE', KEYS[1], window + 1000)
+    return {1, count + 1, window}
+end
+local oldest = redis.call('ZRANGE', KEYS[1], 0, 0, 'WITHSCORES')
+return {0, count, tonumber(oldest[2]) + window - now}
+"""
+
+# Approximate sliding window for anonymous clients: two fixed-window counters
+# (current and previous bucket), with the previous one weighted by how much of
+# it still overlaps the rolling window. Memory stays O(1) per client however
+# hard it bursts. Returns {allowed, estimated_count, reset_ms}.
+APPROXIMATE_WINDOW_SCRIPT = """
+local elapsed = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+local limit = tonumber(ARGV[3])
+local current = tonumber(redis.call('GET', KEYS[1]) or '0')
+local previous = tonumber(redis.call('GET', KEYS[2]) or '0')
+local count = math.floor(previous * (window - elapsed) / window) + current
+if count >= limit then
+    return {0, count, window - elapsed}
+end
+if redis.call('INCR', KEYS[1]) == 1 then
+    redis.call('PEXPIRE', KEYS[1], window * 2)
+end
+return {1, count + 1, window - elapsed}
+"""
+
+async def load_rate_limit_scripts(redis_client: aioredis.Redis):
+    """
+    Load the rate limit scripts into Redis (called from the app lifespan), so
+    the first requests after startup don't each take the NOSCRIPT fallback
+    """
+    for script in (SLIDING_WINDOW_SCRIPT, APPROXIMATE_WINDOW_SCRIPT):
+        await redis_client.script_load(script)
+
 class RateLimiterMiddleware(BaseHTTPMiddleware):
     def __init__(
         self, 
         app, 
-        redis_url: str = None,
+        redis_client: Optional[aioredis.Redis] = None,
         default_limit: int = None,
         default_window: int = None,
-        client_resolver: Optional[Callable[[Request], str]] = None
+        client_resolver: Optional[Callable[[Request], str]] = None,
+        exclude_paths: Optional[list] = None,
+        pre_auth: bool = False
     ):
         super().__init__(app)
         settings = get_settings()
         
-        self.redis_url = redis_url or settings.redis_url
         self.default_limit = default_limit or settings.rate_limit_per_minute
         self.default_window = default_window or settings.rate_limit_window_seconds
         
@@ -29,30 +80,33 @@ class RateLimiterMiddleware(BaseHTTPMiddleware):
         self.client_limits: Dict[str, int] = {
             "admin": self.default_limit * 5,      # Admins get higher rate limits
             "service": self.default_limit * 10,    # Service-to-service gets even higher
-            "anonymous": int(self.default_limit * 0.5)  # Anonymous gets lower
+            "anonymous": int(self.default_limit * 0.5),  # Anonymous gets lower
+            "ip": self.default_limit * 10  # Pre-auth cap per IP, shared by everyone behind it
         }
         
-        # Custom resolver for client identification
-        self.client_resolver = client_resolver or self._default_client_resolver
+        # Paths that are never rate limited (e.g. health probes), checked
+        # before any Redis call
+        self._skip_prefixes = tuple(exclude_paths or settings.rate_limit_exclude_paths)
         
-        # Initialize Redis connection
-        try:
-            self.redis = redis.from_url(self.redis_url)
-            # Test connection
-            self.redis.ping()
-            logger.info(f"Connected to Redis at {self.redis_url}")
-        except redis.exceptions.ConnectionError as e:
-            logger.error(f"Failed to connect to Redis: {e}")
-            # Still create the middleware, but log the error
-            # Consider implementing a fallback strategy
-            self.redis = None
+        # Custom resolver for client identification. In front of the auth
+        # middleware (pre_auth) every request is limited by IP alone, so
+        # missing or invalid tokens are throttled before they are verified.
+        if client_resolver is None:
+            client_resolver = self._ip_client_resolver if pre_auth else self._default_client_resolver
+        self.client_resolver = client_resolver
+        
+        # Use the shared Redis client. Connections are opened lazily from its
+        # pool, so Redis errors surface (and are tolerated) per request.
+        self.redis = redis_client or get_redis_client()
+        # Script objects run via EVALSHA and cache their SHA, falling back
+        # to EVAL (which loads the script) if Redis was restarted
+        self.sliding_window_script = self.redis.register_script(SLIDING_WINDOW_SCRIPT)
+        self.approximate_window_script = self.redis.register_script(APPROXIMATE_WINDOW_SCRIPT)
     
     async def dispatch(self, request: Request, call_next):
-        # Skip rate limiting if Redis is not available
-        if not self.redis:
-            logger.warning("Rate limiting disabled - Redis unavailable")
+        if request.url.path.startswith(self._skip_prefixes):
             return await call_next(request)
-            
+        
         # Get client identifier and type
         client_id, client_type = await self.client_resolver(request)
         
@@ -61,59 +115,39 @@ class RateLimiterMiddleware(BaseHTTPMiddleware):
         
         # Create Redis key
         key = f"rate_limit:{client_id}"
-        window_key = f"{key}:window"
         
         try:
-            # Get current count
-            count = self.redis.get(key)
-            count = int(count) if count else 0
+            # Check and record this request in one atomic round trip
+            allowed, count, reset_ms = await self._check_limit(key, client_type, limit)
+            remaining_seconds = max(0, -(-reset_ms // 1000))
+            window_expires = int(time.time()) + remaining_seconds
             
-            # Check if we need to create a new window
-            if count == 0:
-                current_time = int(time.time())
-                window_expires = current_time + self.default_window
-                
-                pipeline = self.redis.pipeline()
-                pipeline.set(key, 1)
-                pipeline.expireat(key, window_expires)
-                pipeline.set(window_key, window_expires)
-                pipeline.expireat(window_key, window_expires)
-                pipeline.execute()
-                
-                # Add rate limit headers
-                response = await call_next(request)
-                self._add_rate_limit_headers(response, 1, limit)
-                return response
-            else:
-                # Increment and check
-                count = self.redis.incr(key)
-                window_expires = int(self.redis.get(window_key) or 0)
+            # Check if exceeded
+            if not allowed:
+                logger.warning(f"Rate limit exceeded for {client_id} ({client_type})")
                 
-                # Check if exceeded
-                if count > limit:
-                    remaining_seconds = window_expires - int(time.time())
-                    logger.warning(f"Rate limit exceeded for {client_id} ({client_type})")
-                    
-                    return JSONResponse(
-                        status_code=429,
-                        content={
-                            "detail": "Rate limit exceeded",
-                            "reset_in_seconds": max(0, remaining_seconds)
-                        },
-                        headers={
-                            "X-RateLimit-Limit": str(limit),
-                            "X-RateLimit-Remaining": "0",
-                            "X-RateLimit-Reset": str(window_expires),
-                            "Retry-After": str(max(0, remaining_seconds))
-                        }
-                    )
-                
-                # Process the request
-                response = await call_next(request)
-                
-                # Add rate limit headers
+                return ORJSONResponse(
+                    status_code=429,
+                    content={
+                        "detail": "Rate limit exceeded",
+                        "reset_in_seconds": remaining_seconds
+                    },
+                    headers={
+                        "X-RateLimit-Limit": str(limit),
+                        "X-RateLimit-Remaining": "0",
+                        "X-RateLimit-Reset": str(window_expires),
+                        "Retry-After": str(remaining_seconds)
+                    }
+                )
+            
+            # Process the request
+            response = await call_next(request)
+            
+            # Add rate limit headers, unless an inner (per-client) limiter
+            # already reported its own, more specific limit
+            if "X-RateLimit-Limit" not in response.headers:
                 self._add_rate_limit_headers(response, count, limit, window_expires)
-                return response
+            return response
                 
         except redis.exceptions.RedisError as e:
             logger.error(f"Redis error during rate limiting: {e}")
@@ -123,6 +157,33 @@ class RateLimiterMiddleware(BaseHTTPMiddleware):
             logger.error(f"Unexpected error in rate limiter: {e}")
             return await call_next(request)
     
+    async def _check_limit(self, key: str, client_type: str, limit: int) -> Tuple[int, int, int]:
+        """
+        Run the rate limit script for a client.
+        
+        Clients keyed by IP (anonymous and pre-auth; the most likely to burst)
+        use the two-bucket approximation; everyone else gets the exact
+        sliding window log.
+        
+        Returns a tuple of (allowed, count, reset_ms)
+        """
+        now_ms = time.time_ns() // 1_000_000
+        window_ms = self.default_window * 1000
+        
+        if client_type in ("anonymous", "ip"):
+            bucket, elapsed = divmod(now_ms, window_ms)
+            return await self.approximate_window_script(
+                keys=[f"{key}:{bucket}", f"{key}:{bucket - 1}"],
+                args=[elapsed, window_ms, limit],
+            )
+        
+        # Members must be unique so concurrent requests in the same
+        # millisecond are all counted
+        member = f"{now_ms}-{secrets.token_hex(4)}"
+        return await self.sliding_window_script(
+            keys=[key], args=[now_ms, window_ms, limit, member]
+        )
+    
     def _add_rate_limit_headers(self, response, current: int, limit: int, reset: Optional[int] = None):
         """Add rate limit headers to the response"""
         response.headers["X-RateLimit-Limit"] = str(limit)
@@ -134,32 +195,33 @@ class RateLimiterMiddleware(BaseHTTPMiddleware):
             if reset_in > 0:
                 response.headers["Retry-After"] = str(reset_in)
     
+    async def _ip_client_resolver(self, request: Request) -> tuple[str, str]:
+        """Identify every client by IP address (pre-auth limiting)"""
+        return f"pre:ip:{request.client.host}", "ip"
+    
     async def _default_client_resolver(self, request: Request) -> tuple[str, str]:
         """
         Default client resolver that identifies clients based on:
         1. Token information (if authenticated)
         2. IP address (if not authenticated)
         
+        The verified claims are read from the request state set by the auth
+        middleware, so the token itself is not looked at again.
+        
         Returns a tuple of (client_id, client_type)
         """
         # Check if authenticated
-        if hasattr(request.state, "user"):
+        user_info = getattr(request.state, "user", None)
+        if user_info is not None:
             # Use user ID or subject from the token
-            user_info = request.state.user
             client_id = user_info.get("sub", "unknown")
             
             # Determine client type based on roles
-            realm_access = user_info.get("realm_access", {})
-            roles = realm_access.get("roles", [])
-            
-            if "admin" in roles:
-                client_type = "admin"
-            else:
-                client_type = "authenticated"
+            roles = user_info.get("realm_access", {}).get("roles", ())
+            client_type = "admin" if "admin" in roles else "authenticated"
         else:
             # Use client IP for unauthenticated requests
-            client_ip = request.client.host
-            client_id = f"ip:{client_ip}"
+            client_id = f"ip:{request.client.host}"
             client_type = "anonymous"
             
-        return client_id, client_type
\ No newline at end of file
+        return client_id, client_type
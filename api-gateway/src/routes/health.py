@@ -1,10 +1,14 @@
+import asyncio
 import time
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Request, status
 from pydantic import BaseModel
-from typing import Dict, List, Any, Optional
+from typing import Awaitable, Callable, Dict, List, Any, Optional, Tuple
+import httpx
 import redis
+import redis.asyncio as aioredis
 from src.config.settings import get_settings
 import logging
+import os
 import platform
 import sys
 
@@ -34,24 +38,82 @@ class HealthResponse(BaseModel):
 # Track application start time
 START_TIME = time.time()
 
+# Static settings reported by every health check, read once at import
+_settings = get_settings()
+API_VERSION = _settings.app_version
+ENVIRONMENT = _settings.environment
+
+# Host details don't change while the process runs; platform() and
+# architecture() are relatively expensive to compute
+SYSTEM_INFO = {
+    "python_version": sys.version,
+    "platform": platform.platform(),
+    "architecture": platform.architecture()[0],
+    "cpu_count": os.cpu_count(),
+}
+
+# Dependency check results are reused for this long, so frequent probes don't
+# each ping every dependency
+HEALTH_CACHE_TTL = 0.5  # seconds
+_check_cache: Dict[str, Tuple[float, DependencyHealth]] = {}
+_check_locks: Dict[str, asyncio.Lock] = {}
+
+async def cached_check(name: str, check: Callable[[], Awaitable[DependencyHealth]]) -> DependencyHealth:
+    """
+    Run a dependency check at most once per HEALTH_CACHE_TTL.
+    
+    Concurrent callers wait on a per-check lock and share the result of a
+    single in-flight check.
+    """
+    cached = _check_cache.get(name)
+    if cached and time.monotonic() - cached[0] < HEALTH_CACHE_TTL:
+        return cached[1]
+    
+    async with _check_locks.setdefault(name, asyncio.Lock()):
+        # Another caller may have refreshed it while we waited
+        cached = _check_cache.get(name)
+        if cached and time.monotonic() - cached[0] < HEALTH_CACHE_TTL:
+            return cached[1]
+        
+        result = await check()
+        _check_cache[name] = (time.monotonic(), result)
+        return result
+
+# Shared Redis client, opened and closed by the app lifespan. An async
+# dependency, so probes don't take a threadpool hop to resolve it.
+async def get_app_redis(request: Request) -> aioredis.Redis:
+    return request.app.state.redis
+
 @router.get("", response_model=HealthResponse, summary="Check API health")
-async def health_check():
+async def health_check(
+    request: Request,
+    redis_client: aioredis.Redis = Depends(get_app_redis),
+):
     """
     Health check endpoint that verifies:
     - API Gateway status
     - Redis connection
+    - Product service reachability
     - Uptime and environment information
     
     This endpoint is public and doesn't require authentication.
     """
-    settings = get_settings()
-    dependencies = []
     overall_status = "healthy"
     current_time = time.time()
     
-    # Check Redis connection
-    redis_status = await check_redis_connection(settings.redis_url)
-    dependencies.append(redis_status)
+    # Check all dependencies concurrently
+    checks = {
+        "redis": cached_check("redis", lambda: check_redis_connection(redis_client)),
+        "product-service": cached_check(
+            "product-service", lambda: check_product_service(request.app.state.http)
+        ),
+    }
+    results = await asyncio.gather(*checks.values(), return_exceptions=True)
+    dependencies = [
+        result if isinstance(result, DependencyHealth)
+        else DependencyHealth(name=name, status="failing", error=str(result))
+        for name, result in zip(checks, results)
+    ]
     
     # If any dependency is not healthy, mark the overall status as degraded
     if any(d.status != "healthy" for d in dependencies):
@@ -61,22 +123,14 @@ async def health_check():
     if any(d.status == "failing" for d in dependencies):
         overall_status = "unhealthy"
     
-    # Basic system info
-    system_info = {
-        "python_version": sys.version,
-        "platform": platform.platform(),
-        "architecture": platform.architecture()[0],
-        "cpu_count": platform.os.cpu_count(),
-    }
-    
     return HealthResponse(
         status=overall_status,
-        api_version=settings.app_version,
-        environment=settings.environment,
+        api_version=API_VERSION,
+        environment=ENVIRONMENT,
         timestamp=current_time,
         uptime=round(current_time - START_TIME, 2),
         dependencies=dependencies,
-        system_info=system_info
+        system_info=SYSTEM_INFO
     )
 
 @router.get("/ping", summary="Simple ping endpoint")
@@ -88,17 +142,15 @@ async def ping():
     return {"message": "pong", "timestamp": time.time()}
 
 @router.get("/ready", summary="Readiness check")
-async def readiness_check():
+async def readiness_check(redis_client: aioredis.Redis = Depends(get_app_redis)):
     """
     Checks if the service is ready to accept traffic.
     
     This is similar to the main health check but used specifically for readiness
     probes in container orchestration environments like Kubernetes.
     """
-    settings = get_settings()
-    
     # Check Redis connection - critical for rate limiting
-    redis_status = await check_redis_connection(settings.redis_url)
+    redis_status = await cached_check("redis", lambda: check_redis_connection(redis_client))
     
     if redis_status.status != "healthy":
         raise HTTPException(
@@ -108,14 +160,13 @@ async def readiness_check():
     
     return {"status": "ready", "timestamp": time.time()}
 
-async def check_redis_connection(redis_url: str) -> DependencyHealth:
+async def check_redis_connection(redis_client: aioredis.Redis) -> DependencyHealth:
     """Test Redis connection and return its status"""
     try:
-        start_time = time.time()
-        # Try to connect to Redis
-        redis_client = redis.from_url(redis_url)
-        redis_client.ping()
-        latency = int((time.time() - start_time) * 1000)
+        start_time = time.perf_counter()
+        # Ping over the shared connection pool
+        await redis_client.ping()
+        latency = int((time.perf_counter() - start_time) * 1000)
         
         return DependencyHealth(
             name="redis",
@@ -135,3 +186,32 @@ async def check_redis_connection(redis_url: str) -> DependencyHealth:
             status="degraded",
             error=f"Unexpected error: {str(e)}",
         )
+
+async def check_product_service(http_client: httpx.AsyncClient) -> DependencyHealth:
+    """Test that the product service is reachable and return its status"""
+    try:
+        start_time = time.perf_counter()
+        # Any response means the service is up; only 5xx counts as degraded
+        response = await http_client.get("/health", timeout=2.0)
+        latency = int((time.perf_counter() - start_time) * 1000)
+        
+        if response.status_code >= 500:
+            return DependencyHealth(
+                name="product-service",
+                status="degraded",
+                error=f"Service returned {response.status_code}",
+                latency_ms=latency
+            )
+        
+        return DependencyHealth(
+            name="product-service",
+            status="healthy",
+            message="Connection successful",
+            latency_ms=latency
+        )
+    except httpx.RequestError as e:
+        return DependencyHealth(
+            name="product-service",
+            status="failing",
+            error=f"Connection error: {str(e)}",
+        )
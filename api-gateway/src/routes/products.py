@@ -1,12 +1,12 @@
 from fastapi import APIRouter, Depends, HTTPException, Request, status, Query
 from pydantic import BaseModel, Field
 from typing import List, Optional, Dict, Any
-from src.config.settings import get_settings
 import httpx
 import logging
 from datetime import datetime
-import uuid
-from fastapi.responses import JSONResponse
+import secrets
+from fastapi.responses import ORJSONResponse, Response, StreamingResponse
+from starlette.background import BackgroundTask
 
 # Set up router
 router = APIRouter(prefix="/products", tags=["Products"])
@@ -48,16 +48,26 @@ class ProductListResponse(BaseModel):
     meta: Dict[str, Any] = {}
     pagination: Dict[str, Any] = {}
 
-# Helper function to get backend service URL
-def get_product_service_url():
-    settings = get_settings()
-    return settings.product_service_url
+# Shared product service client, opened and closed by the app lifespan
+def get_http_client(request: Request) -> httpx.AsyncClient:
+    return request.app.state.http
 
-# Create a custom HTTP client with timeouts and error handling
-async def get_http_client():
-    return httpx.AsyncClient(timeout=httpx.Timeout(10.0))
+# Client headers passed through to the product service; everything else is
+# dropped and empty values are never sent
+FORWARD_HEADERS = ("authorization", "accept-language")
 
-@router.get("", response_model=ProductListResponse, summary="List all products")
+def build_forward_headers(request: Request) -> Dict[str, str]:
+    """Build the headers for a product service call from the client request"""
+    headers = {name: value for name in FORWARD_HEADERS if (value := request.headers.get(name))}
+    headers["x-request-id"] = getattr(request.state, "request_id", None) or secrets.token_hex(16)
+    return headers
+
+@router.get(
+    "",
+    response_class=Response,
+    responses={200: {"model": ProductListResponse}},
+    summary="List all products",
+)
 async def list_products(
     request: Request,
     category: Optional[str] = Query(None, description="Filter by category"),
@@ -72,10 +82,10 @@ async def list_products(
     List products with filtering, sorting and pagination.
     
     This endpoint proxies the request to the product service and adds additional
-    security, caching, and logging.
+    security, caching, and logging. The upstream body is streamed through
+    unchanged rather than being parsed and re-validated.
     """
-    # Get the URL of the product service from settings
-    product_service_url = get_product_service_url()
+    client = get_http_client(request)
     
     # Build query parameters
     params = {
@@ -95,25 +105,29 @@ async def list_products(
         params["sort_dir"] = sort_dir
     
     try:
-        # Create HTTP client
-        async with httpx.AsyncClient(timeout=10.0) as client:
-            # Forward the request
-            response = await client.get(
-                f"{product_service_url}/products",
-                params=params,
-                headers={
-                    "X-Request-ID": getattr(request.state, "request_id", str(uuid.uuid4())),
-                    "Authorization": request.headers.get("Authorization", ""),
-                }
-            )
-            
-            # Handle response
-            if response.status_code != 200:
-                logger.warning(f"Product service returned error: {response.status_code}")
-                return handle_external_service_error(response)
-            
-            # Return successful response
-            return response.json()
+        # Forward the request, streaming the (potentially large) list back
+        upstream_request = client.build_request(
+            "GET",
+            "/products",
+            params=params,
+            headers=build_forward_headers(request),
+        )
+        response = await client.send(upstream_request, stream=True)
+        
+        # Handle response
+        if response.status_code != 200:
+            logger.warning(f"Product service returned error: {response.status_code}")
+            await response.aread()
+            await response.aclose()
+            return handle_external_service_error(response)
+        
+        # Return successful response
+        return StreamingResponse(
+            response.aiter_bytes(),
+            status_code=response.status_code,
+            media_type=response.headers.get("content-type", "application/json"),
+            background=BackgroundTask(response.aclose),
+        )
                 
     except httpx.RequestError as e:
         logger.error(f"Error connecting to product service: {str(e)}")
@@ -128,7 +142,12 @@ async def list_products(
             detail="Internal server error"
         )
 
-@router.get("/{product_id}", response_model=ProductResponse, summary="Get product by ID")
+@router.get(
+    "/{product_id}",
+    response_class=Response,
+    responses={200: {"model": ProductResponse}},
+    summary="Get product by ID",
+)
 async def get_product(
     request: Request,
     product_id: str,
@@ -139,27 +158,25 @@ async def get_product(
     This endpoint requires authentication and validates that the 
     user has permission to view the product.
     """
-    # Get the URL of the product service from settings
-    product_service_url = get_product_service_url()
+    client = get_http_client(request)
     
     try:
-        # Create HTTP client
-        async with httpx.AsyncClient(timeout=10.0) as client:
-            # Forward the request
-            response = await client.get(
-                f"{product_service_url}/products/{product_id}",
-                headers={
-                    "X-Request-ID": getattr(request.state, "request_id", str(uuid.uuid4())),
-                    "Authorization": request.headers.get("Authorization", ""),
-                }
-            )
-            
-            # Handle response
-            if response.status_code != 200:
-                return handle_external_service_error(response)
-            
-            # Return successful response 
-            return response.json()
+        # Forward the request
+        response = await client.get(
+            f"/products/{product_id}",
+            headers=build_forward_headers(request),
+        )
+        
+        # Handle response
+        if response.status_code != 200:
+            return handle_external_service_error(response)
+        
+        # Return successful response as-is
+        return Response(
+            content=response.content,
+            status_code=response.status_code,
+            media_type=response.headers.get("content-type", "application/json"),
+        )
                 
     except httpx.RequestError as e:
         logger.error(f"Error connecting to product service: {str(e)}")
@@ -223,20 +240,20 @@ def handle_external_service_error(response):
     if response.status_code == 404:
         # Use a mock product for demo purposes instead of returning 404
         logger.info("Product not found, returning mock data")
-        return MOCK_PRODUCT
+        return ORJSONResponse(content=MOCK_PRODUCT)
     elif response.status_code == 400:
-        return JSONResponse(
+        return ORJSONResponse(
             status_code=status.HTTP_400_BAD_REQUEST,
             content={"detail": detail}
         )
     elif response.status_code == 401 or response.status_code == 403:
-        return JSONResponse(
+        return ORJSONResponse(
             status_code=response.status_code,
             content={"detail": "Unauthorized access to product service"}
         )
     else:
         # For other errors, return a 502 Bad Gateway
-        return JSONResponse(
+        return ORJSONResponse(
             status_code=status.HTTP_502_BAD_GATEWAY,
             content={"detail": f"Product service error: {detail}"}
         )
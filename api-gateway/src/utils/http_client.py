@@ -1,14 +1,106 @@
+import asyncio
+import copy
+import functools
 import httpx
+import itertools
 import logging
+import orjson
+import random
+import secrets
 import time
-import uuid
-from typing import Dict, Any, Optional, Union, Callable
+from types import MappingProxyType
+from typing import Dict, Any, Optional, Union, Callable, Tuple, List, Hashable
 from fastapi import Request, HTTPException, status
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
 from src.config.settings import get_settings
 
 # Configure logger
 logger = logging.getLogger(__name__)
 
+# Request IDs for calls that don't carry one from an incoming request: a
+# random per-process prefix (PIDs repeat across containers) plus a counter,
+# so generating one costs no syscall
+_REQ_COUNTER = itertools.count()
+_ID_PREFIX = f"{secrets.token_hex(6)}-"
+
+def _generate_request_id() -> str:
+    return _ID_PREFIX + format(next(_REQ_COUNTER), "x")
+
+# Connection pool limits for the shared clients
+DEFAULT_LIMITS = httpx.Limits(
+    max_connections=100,
+    max_keepalive_connections=20,
+    keepalive_expiry=60,
+)
+
+# Only requests that are safe to send twice are retried, and only on
+# failures that suggest a transient problem with the backend
+_IDEMPOTENT_METHODS = frozenset({"GET", "HEAD", "OPTIONS", "PUT", "DELETE"})
+_RETRY_STATUSES = frozenset({502, 503, 504})
+_RETRY_ERRORS = (httpx.ConnectError, httpx.ReadTimeout)
+
+# Pooled clients shared by every ServiceClient in the process, keyed by
+# (origin, timeout, limits) so services on the same host share connections
+_CLIENT_REGISTRY: Dict[Tuple, httpx.AsyncClient] = {}
+
+def _pool_key(
+    base_url: str,
+    timeout: float,
+    limits: httpx.Limits = DEFAULT_LIMITS,
+) -> Tuple:
+    """
+    Registry key for a service's pooled client. Requests are sent with
+    absolute URLs, so clients are shared per origin rather than per base path.
+    """
+    origin = httpx.URL(base_url).copy_with(path="/", query=None, fragment=None)
+    return (
+        str(origin),
+        timeout,
+        (limits.max_connections, limits.max_keepalive_connections, limits.keepalive_expiry),
+    )
+
+def _get_shared_client(key: Tuple) -> httpx.AsyncClient:
+    """
+    Return the pooled client for a registry key, creating it on first use.
+    
+    A client that has been closed is replaced. (No lock is needed: this never
+    awaits, so it can't interleave with another task on the event loop.)
+    """
+    client = _CLIENT_REGISTRY.get(key)
+    if client is None or client.is_closed:
+        _, timeout, (max_connections, max_keepalive, keepalive_expiry) = key
+        client = httpx.AsyncClient(
+            timeout=httpx.Timeout(timeout),
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_keepalive,
+                keepalive_expiry=keepalive_expiry,
+            ),
+            http2=True,
+        )
+        _CLIENT_REGISTRY[key] = client
+    return client
+
+async def close_shared_clients():
+    """Close every pooled client (called on application shutdown)"""
+    clients = list(_CLIENT_REGISTRY.values())
+    _CLIENT_REGISTRY.clear()
+    for client in clients:
+        await client.aclose()
+
+# Backend base URLs by service name, read from settings once
+_SERVICE_URL_MAP: Dict[str, str] = {
+    name: getattr(get_settings(), f"{name}_service_url")
+    for name in ("product", "order", "user")
+}
+
+@functools.lru_cache()
+def _fallback_service_url(service_name: str) -> str:
+    """URL for a service with no configured URL; warns once per service"""
+    logger.warning("No URL found for service %s, using localhost", service_name)
+    return "http://localhost:8000/api"
+
 class ServiceClient:
     """
     A client for making requests to backend services with metrics, retries,
@@ -22,6 +114,7 @@ class ServiceClient:
         timeout: float = 10.0,
         retries: int = 3,
         backoff_factor: float = 0.5,
+        max_inflight: int = 32,
     ):
         """
         Initialize a new service client.
@@ -32,43 +125,74 @@ class ServiceClient:
             timeout: The request timeout in seconds
             retries: The number of times to retry failed requests
             backoff_factor: The backoff factor for retries
+            max_inflight: The maximum number of concurrent requests to the
+                service; tune to the backend's capacity
         """
         self.service_name = service_name
         self._base_url = base_url
         self.timeout = timeout
         self.retries = retries
         self.backoff_factor = backoff_factor
+        self.max_inflight = max_inflight
         self.settings = get_settings()
         
         # If base URL not provided, try to get it from settings
         if self._base_url is None:
             self._base_url = self._get_service_url_from_settings()
             
-        logger.info(f"Initialized {service_name} client with base URL: {self._base_url}")
-    
-    def _get_service_url_from_settings(self) -> str:
-        """Get service URL from settings based on service name"""
-        settings = get_settings()
-        service_key = f"{self.service_name.lower().replace('-', '_')}_service_url"
+        # URL prefix for requests, normalized once
+        self._base = self._base_url.rstrip("/")
         
-        # Try to get from settings
-        if hasattr(settings, service_key):
-            return getattr(settings, service_key)
+        # Headers sent on every request, built once. Identical header values
+        # from call to call also let HTTP/2 (HPACK) index them.
+        self._default_headers = MappingProxyType({"X-Service-Client": service_name})
         
-        # Fallback to common services
-        common_services = {
-            "product": settings.product_service_url,
-            "order": settings.order_service_url,
-            "user": settings.user_service_url,
-        }
+        # Pooled client for this service's host, looked up once and only
+        # fetched again after the pool has been closed
+        self._pool_key = _pool_key(self._base_url, timeout)
+        self._http: Optional[httpx.AsyncClient] = None
         
-        for key, url in common_services.items():
-            if key in self.service_name.lower():
-                return url
-                
-        # Default fallback
-        logger.warning(f"No URL found for service {self.service_name}, using localhost")
-        return f"http://localhost:8000/api"
+        # Bound outstanding requests so a slow backend queues callers here
+        # rather than piling up tasks waiting on the connection pool
+        self._semaphore = asyncio.Semaphore(max_inflight)
+        self._inflight = 0
+            
+        logger.info("Initialized %s client with base URL: %s", service_name, self._base_url)
+    
+    @property
+    def inflight(self) -> int:
+        """Number of requests currently being sent to the service"""
+        return self._inflight
+    
+    @property
+    def _client(self) -> httpx.AsyncClient:
+        """The process-wide pooled client for this service's host"""
+        client = self._http
+        if client is None or client.is_closed:
+            client = self._http = _get_shared_client(self._pool_key)
+        return client
+    
+    async def aclose(self):
+        """
+        Release the client. This is a no-op: the connection pool is shared
+        with every other client for the same host, so it is only closed by
+        close_shared_clients() on application shutdown.
+        """
+    
+    async def __aenter__(self) -> "ServiceClient":
+        return self
+    
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.aclose()
+    
+    def _get_service_url_from_settings(self) -> str:
+        """Get service URL from settings based on service name"""
+        name = self.service_name.lower().replace("-", "_")
+        url = _SERVICE_URL_MAP.get(name)
+        if url is None:
+            # e.g. "product-service" -> product_service_url
+            url = next((u for key, u in _SERVICE_URL_MAP.items() if key in name), None)
+        return url or _fallback_service_url(self.service_name)
     
     async def request(
         self,
@@ -80,7 +204,8 @@ class ServiceClient:
         json_data: Optional[Dict[str, Any]] = None,
         timeout: Optional[float] = None,
         error_handler: Optional[Callable] = None,
-    ) -> Dict[str, Any]:
+        raw: bool = False,
+    ) -> Union[Dict[str, Any], httpx.Response]:
         """
         Make a request to the service.
         
@@ -93,39 +218,24 @@ class ServiceClient:
             json_data: JSON data to include in the body
             timeout: Custom timeout for this request
             error_handler: Custom error handler function
+            raw: Return the httpx Response instead of parsing its JSON body,
+                e.g. to pass the bytes straight through to the client
             
         Returns:
-            The parsed JSON response
+            The parsed JSON response (or the raw Response if raw is set)
             
         Raises:
             HTTPException: If the request fails
         """
-        url = f"{self._base_url.rstrip('/')}/{path.lstrip('/')}"
-        request_id = str(uuid.uuid4())
+        url = self._url(path)
+        request_headers = self._build_headers(original_request, headers)
+        request_id = request_headers.get("X-Request-ID")
         
-        # Prepare headers
-        request_headers = {}
-        
-        # Forward headers from original request if available
-        if original_request:
-            # Forward authorization
-            auth_header = original_request.headers.get("Authorization")
-            if auth_header:
-                request_headers["Authorization"] = auth_header
-                
-            # Forward request ID or generate a new one
-            request_headers["X-Request-ID"] = getattr(
-                original_request.state, "request_id", request_id
-            )
-        else:
-            request_headers["X-Request-ID"] = request_id
-        
-        # Add custom headers
-        if headers:
-            request_headers.update(headers)
-        
-        # Add service client identifier
-        request_headers["X-Service-Client"] = self.service_name
+        # Encode the JSON body with orjson rather than httpx's stdlib json
+        content = None
+        if json_data is not None:
+            content = orjson.dumps(json_data)
+            request_headers["Content-Type"] = "application/json"
         
         # Prepare timeout
         request_timeout = timeout or self.timeout
@@ -133,33 +243,49 @@ class ServiceClient:
         # Start timing
         start_time = time.time()
         
-        # Configure httpx client
-        client_timeout = httpx.Timeout(request_timeout)
-        
         try:
             logger.debug(
-                f"Making {method} request to {url} with timeout {request_timeout}s - "
-                f"Request ID: {request_headers.get('X-Request-ID')}"
+                "Making %s request to %s with timeout %ss - Request ID: %s",
+                method, url, request_timeout, request_id,
             )
             
-            # Create client and make request
-            async with httpx.AsyncClient(timeout=client_timeout) as client:
-                response = await client.request(
-                    method=method,
-                    url=url,
-                    headers=request_headers,
-                    params=params,
-                    json=json_data,
+            # Idempotent requests are retried with exponential backoff on
+            # connection errors, read timeouts and 502/503/504 responses
+            retryable = method.upper() in _IDEMPOTENT_METHODS
+            for attempt in range(self.retries + 1):
+                can_retry = retryable and attempt < self.retries
+                try:
+                    response = await self._send(
+                        method, url, request_headers, params, content, timeout
+                    )
+                except _RETRY_ERRORS as e:
+                    if not can_retry:
+                        raise
+                    reason = type(e).__name__
+                    delay = self._retry_delay(attempt)
+                else:
+                    if not can_retry or response.status_code not in _RETRY_STATUSES:
+                        break
+                    reason = f"status {response.status_code}"
+                    delay = self._retry_delay(
+                        attempt, response.headers.get("Retry-After"), request_timeout
+                    )
+                
+                logger.warning(
+                    "%s %s %s failed (%s), retrying in %.2fs (attempt %d/%d) - Request ID: %s",
+                    self.service_name, method, path, reason, delay,
+                    attempt + 1, self.retries, request_id,
                 )
+                await asyncio.sleep(delay)
             
             # Calculate response time
             response_time = time.time() - start_time
             
             # Log request metrics
             logger.info(
-                f"{self.service_name} {method} {path} completed in {response_time:.3f}s "
-                f"with status {response.status_code} - "
-                f"Request ID: {request_headers.get('X-Request-ID')}"
+                "%s %s %s completed in %.3fs with status %d - Request ID: %s",
+                self.service_name, method, path, response_time,
+                response.status_code, request_id,
             )
             
             # Handle errors
@@ -169,16 +295,22 @@ class ServiceClient:
                 else:
                     return self._default_error_handler(response)
             
+            if raw:
+                return response
+            
             # Parse and return JSON response
-            return response.json()
+            return orjson.loads(response.content)
             
+        except HTTPException:
+            # Raised by the error handler; pass it through unchanged
+            raise
         except httpx.RequestError as e:
             # Calculate response time
             response_time = time.time() - start_time
             
             logger.error(
-                f"{self.service_name} {method} {path} failed after {response_time:.3f}s: {str(e)} - "
-                f"Request ID: {request_headers.get('X-Request-ID')}"
+                "%s %s %s failed after %.3fs: %s - Request ID: %s",
+                self.service_name, method, path, response_time, e, request_id,
             )
             
             raise HTTPException(
@@ -190,9 +322,8 @@ class ServiceClient:
             response_time = time.time() - start_time
             
             logger.error(
-                f"Unexpected error in {self.service_name} {method} {path} "
-                f"after {response_time:.3f}s: {str(e)} - "
-                f"Request ID: {request_headers.get('X-Request-ID')}"
+                "Unexpected error in %s %s %s after %.3fs: %s - Request ID: %s",
+                self.service_name, method, path, response_time, e, request_id,
             )
             
             raise HTTPException(
@@ -200,6 +331,232 @@ class ServiceClient:
                 detail=f"Error communicating with {self.service_name} service: {str(e)}"
             )
     
+    async def _send(
+        self,
+        method: str,
+        url: str,
+        headers: Dict[str, str],
+        params: Optional[Dict[str, Any]],
+        content: Optional[bytes],
+        timeout: Optional[float],
+    ) -> httpx.Response:
+        """
+        Send one attempt over the pooled client, within the in-flight limit.
+        The client's timeout is only overridden when the caller asked for one.
+        """
+        async with self._semaphore:
+            self._inflight += 1
+            try:
+                return await self._client.request(
+                    method=method,
+                    url=url,
+                    headers=headers,
+                    params=params,
+                    content=content,
+                    timeout=timeout if timeout is not None else httpx.USE_CLIENT_DEFAULT,
+                )
+            finally:
+                self._inflight -= 1
+    
+    def _retry_delay(
+        self,
+        attempt: int,
+        retry_after: Optional[str] = None,
+        max_delay: Optional[float] = None,
+    ) -> float:
+        """
+        Seconds to wait before the next attempt: exponential backoff with
+        jitter, or the backend's Retry-After (in seconds) when it asks for
+        longer, capped at max_delay
+        """
+        delay = self.backoff_factor * (2 ** attempt) + random.uniform(0, self.backoff_factor)
+        if retry_after:
+            try:
+                delay = max(delay, float(retry_after))
+            except ValueError:
+                # HTTP-date form; keep the backoff delay
+                pass
+        if max_delay is not None:
+            delay = min(delay, max_delay)
+        return delay
+    
+    async def gather(
+        self,
+        calls: List[Tuple[str, str, Dict[str, Any]]],
+        *,
+        dedup: bool = True,
+    ) -> List[Any]:
+        """
+        Make several independent requests to the service concurrently.
+        
+        Args:
+            calls: (method, path, kwargs) tuples; kwargs are passed to request()
+            dedup: Send identical GET requests only once and share the result
+            
+        Returns:
+            The results, in the same order as calls. Repeated calls collapsed
+            by dedup each get their own shallow copy of the result.
+            
+        Raises:
+            HTTPException: The first failure among the calls (all calls are
+                still allowed to finish)
+        """
+        unique: List[Tuple[str, str, Dict[str, Any]]] = []
+        slots: List[int] = []
+        seen: Dict[Hashable, int] = {}
+        
+        for method, path, kwargs in calls:
+            key = self._dedup_key(method, path, kwargs) if dedup else None
+            if key is not None and key in seen:
+                slots.append(seen[key])
+                continue
+            
+            if key is not None:
+                seen[key] = len(unique)
+            slots.append(len(unique))
+            unique.append((method, path, kwargs))
+        
+        results = await asyncio.gather(
+            *(self.request(method, path, **kwargs) for method, path, kwargs in unique),
+            return_exceptions=True,
+        )
+        
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+        
+        # The first call for each request gets the result itself, duplicates
+        # a shallow copy, so mutating one result doesn't change the others
+        returned = set()
+        output = []
+        for slot in slots:
+            if slot in returned:
+                output.append(copy.copy(results[slot]))
+            else:
+                returned.add(slot)
+                output.append(results[slot])
+        return output
+    
+    @staticmethod
+    def _dedup_key(method: str, path: str, kwargs: Dict[str, Any]) -> Optional[Hashable]:
+        """
+        Identity of a GET call for gather(), or None if it can't be shared.
+        Only plain GETs (params, headers, original_request) are collapsed.
+        """
+        if method.upper() != "GET" or not kwargs.keys() <= {"params", "headers", "original_request"}:
+            return None
+        try:
+            return (
+                path,
+                frozenset((kwargs.get("params") or {}).items()),
+                frozenset((kwargs.get("headers") or {}).items()),
+                id(kwargs.get("original_request")),
+            )
+        except TypeError:
+            # Unhashable parameter values (e.g. lists)
+            return None
+    
+    async def stream(
+        self,
+        method: str,
+        path: str,
+        original_request: Optional[Request] = None,
+        headers: Optional[Dict[str, str]] = None,
+        params: Optional[Dict[str, Any]] = None,
+        chunk_size: int = 65536,
+    ) -> StreamingResponse:
+        """
+        Proxy a request to the service, streaming the response body back to
+        the client without buffering or parsing it.
+        
+        The request holds one of the service's in-flight slots until the
+        upstream response is closed, after the body has been sent.
+        
+        Raises:
+            HTTPException: If the request fails or the service returns an error
+        """
+        request_headers = self._build_headers(original_request, headers)
+        client = self._client
+        upstream_request = client.build_request(
+            method, self._url(path), headers=request_headers, params=params
+        )
+        
+        await self._semaphore.acquire()
+        self._inflight += 1
+        try:
+            response = await client.send(upstream_request, stream=True)
+        except httpx.RequestError as e:
+            self._release_slot()
+            logger.error(
+                "%s %s %s failed: %s - Request ID: %s",
+                self.service_name, method, path, e, request_headers.get("X-Request-ID"),
+            )
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail=f"{self.service_name} service unavailable: {str(e)}"
+            )
+        except BaseException:
+            self._release_slot()
+            raise
+        
+        if response.status_code >= 400:
+            try:
+                await response.aread()
+            finally:
+                await self._close_stream(response)
+            self._default_error_handler(response)
+        
+        return StreamingResponse(
+            response.aiter_bytes(chunk_size=chunk_size),
+            status_code=response.status_code,
+            media_type=response.headers.get("content-type", "application/json"),
+            background=BackgroundTask(self._close_stream, response),
+        )
+    
+    async def _close_stream(self, response: httpx.Response):
+        """Close a streamed upstream response and free its in-flight slot"""
+        try:
+            await response.aclose()
+        finally:
+            self._release_slot()
+    
+    def _release_slot(self):
+        self._inflight -= 1
+        self._semaphore.release()
+    
+    def _url(self, path: str) -> str:
+        return self._base + path if path.startswith("/") else f"{self._base}/{path}"
+    
+    def _build_headers(
+        self,
+        original_request: Optional[Request],
+        headers: Optional[Dict[str, str]],
+    ) -> Dict[str, str]:
+        """Build the outgoing headers for a request"""
+        request_headers = {}
+        
+        # Forward headers from original request if available
+        if original_request:
+            # Forward authorization
+            auth_header = original_request.headers.get("Authorization")
+            if auth_header:
+                request_headers["Authorization"] = auth_header
+                
+            # Forward request ID or generate a new one
+            request_headers["X-Request-ID"] = (
+                getattr(original_request.state, "request_id", None) or _generate_request_id()
+            )
+        else:
+            request_headers["X-Request-ID"] = _generate_request_id()
+        
+        # Add custom headers
+        if headers:
+            request_headers.update(headers)
+        
+        # Add service client identifier
+        request_headers.update(self._default_headers)
+        return request_headers
+    
     async def get(self, path: str, **kwargs) -> Dict[str, Any]:
         """Make a GET request to the service"""
         return await self.request("GET", path, **kwargs)
@@ -234,7 +591,7 @@ class ServiceClient:
         
         # Try to parse error response
         try:
-            error_data = response.json()
+            error_data = orjson.loads(response.content)
             detail = error_data.get("detail", "Unknown error")
         except Exception:
             detail = f"Error from {self.service_name} service"
@@ -261,3 +618,27 @@ class ServiceClient:
                 status_code=status.HTTP_502_BAD_GATEWAY,
                 detail=f"{self.service_name} service error: {detail}"
             )
+
+
+# Service clients handed out to routes, one per service name
+_SERVICE_CLIENTS: Dict[str, ServiceClient] = {}
+
+def get_service_client(service_name: str) -> Callable[[], ServiceClient]:
+    """
+    Build a FastAPI dependency that provides the shared client for a service,
+    so route handlers never construct clients per request.
+    
+    Usage:
+        @router.get("/orders")
+        async def list_orders(orders: ServiceClient = Depends(get_service_client("order"))):
+            ...
+    """
+    # Async so it runs on the event loop: no threadpool hop per request,
+    # and concurrent first calls can't each build their own client
+    async def dependency() -> ServiceClient:
+        client = _SERVICE_CLIENTS.get(service_name)
+        if client is None:
+            client = _SERVICE_CLIENTS[service_name] = ServiceClient(service_name)
+        return client
+    
+    return dependency
@@ -1,11 +1,22 @@
+import asyncio
+import base64
+import functools
+import binascii
+import datetime
 import hashlib
 import hmac
 import time
 import secrets
 import jwt
 import logging
+import orjson
+import os
+from concurrent.futures import ThreadPoolExecutor
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
 from typing import Dict, Any, Optional, List, Union
 from src.config.settings import get_settings
+from src.utils.token_cache import TokenCache
 
 # Set up logger
 logger = logging.getLogger(__name__)
@@ -14,6 +25,43 @@ logger = logging.getLogger(__name__)
 DEFAULT_JWT_ALGORITHM = "HS256"
 TOKEN_EXPIRY = 3600  # 1 hour in seconds
 
+# Settings read on every token issue and verification, bound once at import
+_SETTINGS = get_settings()
+_SECRET = _SETTINGS.keycloak_client_secret
+_SECRET_BYTES = _SECRET.encode("utf-8")
+_ISSUER = _SETTINGS.app_name
+
+# Claims shared by every token create_jwt_token issues; copied per token
+_TOKEN_TEMPLATE: Dict[str, Any] = {"iss": _ISSUER}
+
+# Base64url header written by create_jwt_token (and PyJWT in general); tokens
+# carrying it skip header JSON parsing
+_HS256_HEADER_B64 = (
+    base64.urlsafe_b64encode(b'{"alg":"HS256","typ":"JWT"}').rstrip(b"=").decode()
+)
+_HS256_SIGNING_PREFIX = _HS256_HEADER_B64.encode("ascii") + b"."
+
+# Time claims PyJWT converts from datetime; tokens setting them that way are
+# left to PyJWT
+_TIME_CLAIMS = ("exp", "iat", "nbf")
+
+# Payloads of tokens already verified by decode_jwt, reused until the token
+# expires (or for at most 5 minutes)
+_decoded_tokens = TokenCache(maxsize=10_000, max_ttl=300)
+
+# scrypt work factors for new (v2) password hashes (~32 MiB of memory each)
+SCRYPT_N = 2 ** 15
+SCRYPT_R = 8
+SCRYPT_P = 1
+SCRYPT_MAXMEM = 64 * 1024 * 1024
+
+# Password hashing is deliberately CPU-heavy; the async helpers run it here
+# so it doesn't block the event loop (hashlib releases the GIL meanwhile)
+_KDF_POOL = ThreadPoolExecutor(max_workers=os.cpu_count(), thread_name_prefix="kdf")
+
+# Characters stripped by sanitize_input, as a translate() deletion table
+_SANITIZE_TABLE = str.maketrans("", "", "<>&\"';`$(){}\\")
+
 def generate_secure_token(length: int = 32) -> str:
     """
     Generate a cryptographically secure random token.
@@ -24,7 +72,7 @@ def generate_secure_token(length: int = 32) -> str:
     Returns:
         A secure random token as a hex string
     """
-    return secrets.token_hex(length)
+    return os.urandom(length).hex()
 
 def hash_password(password: str, salt: Optional[str] = None) -> tuple[str, str]:
     """
@@ -38,33 +86,101 @@ def hash_password(password: str, salt: Optional[str] = None) -> tuple[str, str]:
         A tuple of (hashed_password, salt)
     """
     if salt is None:
-        salt = secrets.token_hex(16)
+        salt = os.urandom(16).hex()
     
-    # Use PBKDF2 with SHA-256
-    key = hashlib.pbkdf2_hmac(
-        "sha256",
+    return _pbkdf2(password.encode("utf-8"), salt.encode("utf-8")).hex(), salt
+
+def _pbkdf2(password: bytes, salt: bytes) -> bytes:
+    """Derive the raw legacy password key"""
+    # Use PBKDF2 with SHA-256, computed by OpenSSL through cryptography
+    return PBKDF2HMAC(
+        algorithm=hashes.SHA256(),
+        length=64,  # Key length
+        salt=salt,
+        iterations=100000,  # Number of iterations
+    ).derive(password)
+
+def hash_password_v2(password: str) -> str:
+    """
+    Hash a password with scrypt.
+    
+    Args:
+        password: The plaintext password to hash
+        
+    Returns:
+        A self-describing hash string, "scrypt$n$r$p$salt$hash", that
+        verify_password can check without a separate salt
+    """
+    salt = os.urandom(16).hex()
+    key = hashlib.scrypt(
         password.encode("utf-8"),
-        salt.encode("utf-8"),
-        100000,  # Number of iterations
-        64  # Key length
+        salt=salt.encode("utf-8"),
+        n=SCRYPT_N,
+        r=SCRYPT_R,
+        p=SCRYPT_P,
+        maxmem=SCRYPT_MAXMEM,
+        dklen=64,
     ).hex()
     
-    return key, salt
+    return f"scrypt${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}${salt}${key}"
 
-def verify_password(password: str, hashed_password: str, salt: str) -> bool:
+def verify_password(password: str, hashed_password: str, salt: Optional[str] = None) -> bool:
     """
     Verify a password against its hash.
     
+    Hashes tagged "scrypt$..." (from hash_password_v2) carry their own salt
+    and parameters; untagged hashes are legacy PBKDF2 hashes from
+    hash_password and need the salt.
+    
     Args:
         password: The plaintext password to verify
         hashed_password: The stored hash to check against
-        salt: The salt used in hashing
+        salt: The salt used in hashing (legacy PBKDF2 hashes only)
         
     Returns:
         True if the password matches, False otherwise
     """
-    calculated_hash, _ = hash_password(password, salt)
-    return hmac.compare_digest(calculated_hash, hashed_password)
+    if hashed_password.startswith("scrypt$"):
+        try:
+            _, n, r, p, scrypt_salt, key = hashed_password.split("$")
+            expected = bytes.fromhex(key)
+            calculated = hashlib.scrypt(
+                password.encode("utf-8"),
+                salt=scrypt_salt.encode("utf-8"),
+                n=int(n),
+                r=int(r),
+                p=int(p),
+                maxmem=SCRYPT_MAXMEM,
+                dklen=len(expected),
+            )
+        except ValueError:
+            logger.warning("Malformed scrypt password hash")
+            return False
+        return hmac.compare_digest(calculated, expected)
+    
+    if salt is None:
+        return False
+    
+    try:
+        expected = bytes.fromhex(hashed_password)
+    except ValueError:
+        logger.warning("Malformed password hash")
+        return False
+    return hmac.compare_digest(_pbkdf2(password.encode("utf-8"), salt.encode("utf-8")), expected)
+
+async def hash_password_async(password: str) -> str:
+    """Hash a password with hash_password_v2 off the event loop"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_KDF_POOL, hash_password_v2, password)
+
+async def verify_password_async(
+    password: str,
+    hashed_password: str,
+    salt: Optional[str] = None
+) -> bool:
+    """Run verify_password off the event loop"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_KDF_POOL, verify_password, password, hashed_password, salt)
 
 def create_jwt_token(
     subject: str,
@@ -84,55 +200,159 @@ def create_jwt_token(
     Returns:
         A signed JWT token
     """
-    settings = get_settings()
-    
     now = int(time.time())
-    token_data = {
-        "sub": subject,
-        "iat": now,
-        "exp": now + expires_in,
-        "iss": settings.app_name,
-    }
+    token_data = _TOKEN_TEMPLATE.copy()
+    token_data["sub"] = subject
+    token_data["iat"] = now
+    token_data["exp"] = now + expires_in
     
     if scopes:
-        token_data["scope"] = " ".join(scopes)
+        token_data["scope"] = _joined_scopes(tuple(scopes))
     
     if additional_claims:
         token_data.update(additional_claims)
+        if any(
+            isinstance(token_data.get(claim), datetime.datetime) for claim in _TIME_CLAIMS
+        ):
+            return jwt.encode(token_data, _SECRET, algorithm=DEFAULT_JWT_ALGORITHM)
     
     # In a real application, you would use a proper secret key from settings
-    secret_key = settings.keycloak_client_secret
-    
-    return jwt.encode(token_data, secret_key, algorithm=DEFAULT_JWT_ALGORITHM)
+    try:
+        return _sign_hs256(token_data, _SECRET_BYTES)
+    except orjson.JSONEncodeError:
+        # Claims orjson can't serialize (non-str keys, ints over 64 bits)
+        return jwt.encode(token_data, _SECRET, algorithm=DEFAULT_JWT_ALGORITHM)
+
+@functools.lru_cache(maxsize=256)
+def _joined_scopes(scopes: tuple) -> str:
+    """
+    Build the space-separated scope claim. Cached: applications request
+    the same few scope sets over and over.
+    """
+    return " ".join(scopes)
 
 def decode_jwt(token: str) -> Dict[str, Any]:
     """
     Decode and validate a JWT token.
     
+    Verified payloads are cached, so a token presented again before it
+    expires skips signature verification.
+    
     Args:
         token: The JWT token to decode
         
     Returns:
-        The decoded token payload
+        The decoded token payload (a copy the caller may modify)
         
     Raises:
         jwt.InvalidTokenError: If the token is invalid
     """
-    settings = get_settings()
+    cached = _decoded_tokens.get(token)
+    if cached is not None:
+        return dict(cached)
     
     try:
         # In a real application, you would use a proper secret key from settings
-        secret_key = settings.keycloak_client_secret
-        
-        return jwt.decode(
-            token,
-            secret_key,
-            algorithms=[DEFAULT_JWT_ALGORITHM],
-            options={"verify_signature": True}
-        )
+        if _SETTINGS.jwt_fast_verify:
+            payload = _verify_hs256(token, _SECRET_BYTES)
+        else:
+            payload = jwt.decode(
+                token,
+                _SECRET,
+                algorithms=[DEFAULT_JWT_ALGORITHM],
+                options={"verify_signature": True}
+            )
     except jwt.InvalidTokenError as e:
         logger.warning(f"Invalid token: {str(e)}")
         raise
+    
+    _decoded_tokens.set(token, payload)
+    return dict(payload)
+
+def invalidate_jwt(token: str) -> None:
+    """Drop a token from the decode cache (e.g. on logout)"""
+    _decoded_tokens.invalidate(token)
+
+def _b64url_decode(segment: str) -> bytes:
+    try:
+        return base64.urlsafe_b64decode(segment + "=" * (-len(segment) % 4))
+    except (binascii.Error, ValueError) as e:
+        raise jwt.DecodeError("Invalid token padding") from e
+
+def _b64url_encode(data: bytes) -> bytes:
+    return base64.urlsafe_b64encode(data).rstrip(b"=")
+
+def _sign_hs256(payload: Dict[str, Any], secret: bytes) -> str:
+    """
+    Encode and sign an HS256 JWT without going through PyJWT's algorithm
+    registry and stdlib JSON encoder.
+    
+    The token is equivalent to jwt.encode(payload, secret, algorithm="HS256")
+    (same header, claims and signature scheme), but not always byte-identical:
+    orjson writes non-ASCII characters unescaped and formats some floats
+    differently.
+    
+    Raises:
+        orjson.JSONEncodeError: If orjson can't serialize the payload
+    """
+    signing_input = _HS256_SIGNING_PREFIX + _b64url_encode(orjson.dumps(payload))
+    signature = hmac.new(secret, signing_input, hashlib.sha256).digest()
+    return (signing_input + b"." + _b64url_encode(signature)).decode("ascii")
+
+def _verify_hs256(token: str, secret: bytes) -> Dict[str, Any]:
+    """
+    Verify an HS256 JWT and validate its registered claims.
+    
+    A minimal stand-in for jwt.decode(token, secret, algorithms=["HS256"])
+    for the gateway's own tokens: it raises the same PyJWT exceptions, but
+    skips PyJWT's generic algorithm and options machinery.
+    
+    Raises:
+        jwt.InvalidTokenError: If the token is malformed, forged, or expired
+    """
+    try:
+        header_b64, payload_b64, signature_b64 = token.split(".")
+    except ValueError:
+        raise jwt.DecodeError("Not enough segments")
+    
+    # Only HS256 is accepted; parse the header only if it isn't the standard one
+    if header_b64 != _HS256_HEADER_B64:
+        try:
+            header = orjson.loads(_b64url_decode(header_b64))
+        except orjson.JSONDecodeError as e:
+            raise jwt.DecodeError("Invalid header string") from e
+        if not isinstance(header, dict) or header.get("alg") != DEFAULT_JWT_ALGORITHM:
+            raise jwt.InvalidAlgorithmError("The specified alg value is not allowed")
+    
+    signing_input = f"{header_b64}.{payload_b64}".encode("ascii", "replace")
+    expected = hmac.new(secret, signing_input, hashlib.sha256).digest()
+    if not hmac.compare_digest(expected, _b64url_decode(signature_b64)):
+        raise jwt.InvalidSignatureError("Signature verification failed")
+    
+    try:
+        payload = orjson.loads(_b64url_decode(payload_b64))
+    except orjson.JSONDecodeError as e:
+        raise jwt.DecodeError("Invalid payload string") from e
+    if not isinstance(payload, dict):
+        raise jwt.DecodeError("Invalid payload string: must be a json object")
+    
+    # Same registered-claim checks as PyJWT's defaults (no leeway)
+    now = int(time.time())
+    try:
+        if "exp" in payload and int(payload["exp"]) <= now:
+            raise jwt.ExpiredSignatureError("Signature has expired")
+        if "nbf" in payload and int(payload["nbf"]) > now:
+            raise jwt.ImmatureSignatureError("The token is not yet valid (nbf)")
+        if "iat" in payload and int(payload["iat"]) > now:
+            raise jwt.ImmatureSignatureError("The token is not yet valid (iat)")
+    except (TypeError, ValueError) as e:
+        raise jwt.DecodeError("Time claims (exp, nbf, iat) must be integers") from e
+    
+    # No audience is expected, so tokens scoped to one are rejected
+    if "aud" in payload:
+        raise jwt.InvalidAudienceError("Invalid audience")
+    
+    return payload
 
 def sanitize_input(input_str: str) -> str:
     """
@@ -147,13 +367,17 @@ def sanitize_input(input_str: str) -> str:
     if not input_str:
         return ""
         
-    # Simple sanitization - for production use a proper library
-    dangerous_chars = ["<", ">", "&", '"', "'", ";", "`", "$", "(", ")", "{", "}", "\\"]
-    result = input_str
-    for char in dangerous_chars:
-        result = result.replace(char, "")
-        
-    return result
+    # Simple sanitization - for production use a proper library. Deletes all
+    # dangerous characters in a single pass.
+    return input_str.translate(_SANITIZE_TABLE)
+
+@functools.lru_cache(maxsize=4096)
+def _scope_set(token_scopes: str) -> frozenset:
+    """
+    Parse a space-separated scope claim into a set. Safe to cache: scope
+    strings are immutable token claims, and few distinct ones are in use.
+    """
+    return frozenset(token_scopes.split())
 
 def has_required_scope(
     token_scopes: Union[str, List[str]],
@@ -170,11 +394,9 @@ def has_required_scope(
         True if the token has the required scope, False otherwise
     """
     if isinstance(token_scopes, str):
-        scopes = token_scopes.split()
-    else:
-        scopes = token_scopes
+        return required_scope in _scope_set(token_scopes)
         
-    return required_scope in scopes
+    return required_scope in token_scopes
 
 def generate_api_key() -> str:
     """
@@ -0,0 +1,80 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Tuple
+
+
+class TokenCache:
+    """
+    A bounded, in-process LRU cache of verified token payloads.
+
+    Entries are keyed by a BLAKE2b digest of the raw token (so the tokens
+    themselves are never held in memory) and expire at the token's own
+    ``exp`` claim, capped at ``max_ttl`` seconds when it is set.
+
+    The cache is thread-safe: sync callers such as ``decode_jwt`` may run in
+    FastAPI's threadpool.
+    """
+
+    def __init__(self, maxsize: int = 50_000, max_ttl: Optional[float] = None):
+        """
+        Initialize a new token cache.
+
+        Args:
+            maxsize: The maximum number of tokens to keep
+            max_ttl: Upper bound in seconds on how long an entry is reused;
+                tokens without an ``exp`` claim are only cached when this is set
+        """
+        self.maxsize = maxsize
+        self.max_ttl = max_ttl
+        self._entries: "OrderedDict[bytes, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(token: str) -> bytes:
+        return hashlib.blake2b(token.encode(), digest_size=16).digest()
+
+    def get(self, token: str) -> Optional[Dict[str, Any]]:
+        """Return the cached payload for a token, or None if missing or expired"""
+        key = self._key(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+
+            expires_at, payload = entry
+            if expires_at <= time.time():
+                self._entries.pop(key, None)
+                return None
+
+            self._entries.move_to_end(key)
+            return payload
+
+    def set(self, token: str, payload: Dict[str, Any]) -> None:
+        """Cache a verified payload until the token expires"""
+        now = time.time()
+        expires_at = payload.get("exp")
+        if self.max_ttl is not None:
+            expires_at = min(expires_at or now + self.max_ttl, now + self.max_ttl)
+        if not expires_at or expires_at <= now:
+            return
+
+        key = self._key(token)
+        with self._lock:
+            self._entries[key] = (expires_at, payload)
+            self._entries.move_to_end(key)
+
+            # Evict the least recently used tokens
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, token: str) -> None:
+        """Drop a token from the cache (e.g. on logout)"""
+        key = self._key(token)
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()